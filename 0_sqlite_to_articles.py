@@ -7,22 +7,59 @@ Supports two modes:
   - SQLite mode: Reads from local database file (set DB_PATH)
 
 Usage:
-    python 0_sqlite_to_articles.py [--db <DB_PATH>] [--hours 168] [--end-hour 18]
+    python 0_sqlite_to_articles.py [--db <DB_PATH>] [--hours 168] [--end-hour 18] [--create-indexes]
 """
 import os
 import sys
 import argparse
+import itertools
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+from operator import itemgetter
+from pathlib import Path
 from urllib.parse import urljoin, quote
 from bs4 import BeautifulSoup
-from dotenv import load_dotenv
+from common import cached_dotenv
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
 except ImportError:
     requests = None
 
+# Prefer the C-based lxml parser for HTML cleanup; fall back to the
+# pure-Python html.parser when lxml is not installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Load .env once at import, like the other pipeline scripts
+cached_dotenv()
+
+
+def _build_session():
+    """
+    Build a shared HTTP session so TCP/TLS connections are reused across
+    login, pagination pages and category fetches.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = _build_session() if requests is not None else None
+
 
 # ============================================================================
 # FreshRSS API Functions
@@ -41,11 +78,14 @@ def freshrss_api_login(api_url, user, password):
         "Passwd": password,
     }
     try:
-        resp = requests.post(login_url, data=data, timeout=30)
+        resp = SESSION.post(login_url, data=data, timeout=30)
         resp.raise_for_status()
         for line in resp.text.strip().split("\n"):
             if line.startswith("Auth="):
-                return line[5:]
+                auth_token = line[5:]
+                # Reuse the auth header for all subsequent requests on the session
+                SESSION.headers["Authorization"] = f"GoogleLogin auth={auth_token}"
+                return auth_token
         print(f"API login failed: Auth token not found in response")
         return None
     except requests.RequestException as e:
@@ -53,10 +93,11 @@ def freshrss_api_login(api_url, user, password):
         return None
 
 
-def freshrss_api_get_articles(api_url, auth_token, category, start_ts, end_ts):
+def freshrss_api_get_articles(api_url, auth_token, category, start_ts, end_ts, exclude_feeds=frozenset()):
     """
     Fetch articles from FreshRSS API for a specific category within time range.
     Handles pagination via continuation token.
+    Articles whose feed name is in exclude_feeds are skipped.
     Returns list of (link, title, content, date, feed_name) tuples.
     """
     # URL encode the category name for the API path
@@ -64,7 +105,8 @@ def freshrss_api_get_articles(api_url, auth_token, category, start_ts, end_ts):
     stream_id = f"user/-/label/{quote(category, safe='')}"
     stream_url = f"{base_url}/reader/api/0/stream/contents/{stream_id}"
 
-    headers = {"Authorization": f"GoogleLogin auth={auth_token}"}
+    # Normally already set on the session by freshrss_api_login
+    SESSION.headers.setdefault("Authorization", f"GoogleLogin auth={auth_token}")
     articles = []
     continuation = None
 
@@ -84,7 +126,7 @@ def freshrss_api_get_articles(api_url, auth_token, category, start_ts, end_ts):
             params["c"] = continuation
 
         try:
-            resp = requests.get(stream_url, headers=headers, params=params, timeout=60)
+            resp = SESSION.get(stream_url, params=params, timeout=60)
             resp.raise_for_status()
             data = resp.json()
         except requests.RequestException as e:
@@ -95,13 +137,20 @@ def freshrss_api_get_articles(api_url, auth_token, category, start_ts, end_ts):
             break
 
         items = data.get("items", [])
+        min_pub = float("inf")
         for item in items:
             date_val = item.get("published", 0)
+            min_pub = min(min_pub, date_val)
 
             # Filter by time range (since FreshRSS time params are unreliable)
             if date_val < start_ts or date_val > end_ts:
                 continue
 
+            # Extract feed name from origin
+            feed_name = item.get("origin", {}).get("title", "Unknown")
+            if feed_name in exclude_feeds:
+                continue
+
             link = ""
             if item.get("canonical"):
                 link = item["canonical"][0].get("href", "")
@@ -111,38 +160,100 @@ def freshrss_api_get_articles(api_url, auth_token, category, start_ts, end_ts):
             title = item.get("title", "")
             content = item.get("summary", {}).get("content", "")
 
-            # Extract feed name from origin
-            feed_name = item.get("origin", {}).get("title", "Unknown")
-
             articles.append((link, title, content, date_val, feed_name))
 
-        # Check for more pages - stop if no more items or all items are beyond end_ts
+        # Check for more pages - stop if no more items
         continuation = data.get("continuation")
         if not continuation or not items:
             break
         # Also stop if all items in this batch are after end_ts (no point continuing)
-        if all(item.get("published", 0) > end_ts for item in items):
+        if min_pub > end_ts:
             break
 
     return articles
 
+
+# ============================================================================
+# Article Output
+# ============================================================================
+
+# Number of articles handed to each worker process at a time
+WRITE_CHUNKSIZE = 32
+
+
+@lru_cache(maxsize=512)
+def _format_day(day):
+    """Format a local calendar date; cached since most articles share a handful of days."""
+    return day.strftime("%Y年%m月%d日")
+
+
+def format_date(date_val):
+    """Format a Unix timestamp as a local date string, falling back to the raw value."""
+    try:
+        return _format_day(datetime.fromtimestamp(date_val).date())
+    except Exception:
+        return str(date_val)
+
+
+def write_article(task):
+    """
+    Clean one article's HTML and write it as a text file.
+    Takes an (idx, link, title, content, date, feed_name, output_dir) tuple
+    so it can be used with ProcessPoolExecutor.map.
+    Returns the written file path.
+    """
+    idx, link, title, content, date_val, feed_name, output_dir = task
+    file_path = os.path.join(output_dir, f"article_{idx}.txt")
+    # Clean HTML content
+    soup = BeautifulSoup(content or "", HTML_PARSER)
+    text = soup.get_text().strip()
+    dt_str = format_date(date_val)
+    # Write file with a single write call
+    payload = "\n\n".join((link, title, f"{feed_name} {dt_str}", text)).encode("utf-8")
+    with open(file_path, "wb") as f:
+        f.write(payload)
+    return file_path
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Extract and format articles from FreshRSS (API or SQLite)")
     parser.add_argument("--db", help="Path to FreshRSS SQLite database file (overrides DB_PATH in .env)")
     parser.add_argument("--hours", type=int, default=168, help="Time window in hours (default: 168)")
     parser.add_argument("--end-hour", type=int, default=17, help="End hour of day (0-23) for the window end (default: 17)")
     parser.add_argument("--api", action="store_true", help="Force API mode even if DB_PATH is set")
+    parser.add_argument("--create-indexes", action="store_true",
+                        help="Create date/feed-name indexes in the SQLite database before querying (one-time)")
     return parser.parse_args()
 
 
-def fetch_articles_from_sqlite(db_path, start_ts, end_ts):
-    """Fetch articles from SQLite database."""
+def create_sqlite_indexes(db_path):
+    """
+    One-time migration: add the indexes used by the SQLite query.
+    Only run when requested with --create-indexes since it writes to the FreshRSS database.
+    """
     if not os.path.exists(db_path):
         print(f"Error: database file '{db_path}' not found.")
         sys.exit(1)
 
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    try:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entry_date ON entry(date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_feed_name ON feed(name)")
+        conn.commit()
+    finally:
+        conn.close()
+    print("Ensured SQLite indexes idx_entry_date and idx_feed_name exist.")
+
+
+def iter_articles_from_sqlite(db_path, start_ts, end_ts):
+    """
+    Stream articles from SQLite database.
+    Yields (link, title, content, date, feed_name) tuples straight from the
+    cursor so writing can start while SQLite is still reading.
+    """
+    if not os.path.exists(db_path):
+        print(f"Error: database file '{db_path}' not found.")
+        sys.exit(1)
 
     # Load query conditions from environment variables
     allowed_feed_names_str = os.getenv("ALLOWED_FEED_NAMES")
@@ -158,24 +269,37 @@ def fetch_articles_from_sqlite(db_path, start_ts, end_ts):
         print("Error: ALLOWED_FEED_NAMES resulted in empty list.")
         sys.exit(1)
 
-    feed_name_conditions = " OR ".join(["f.name = ?"] * len(allowed_feed_names))
+    # IN-list (rather than an OR chain) lets the planner use the feed(name) index
+    placeholders = ",".join("?" * len(allowed_feed_names))
     query_template = f'''
     SELECT e.link, e.title, e.content, e.date, f.name
     FROM entry e
     JOIN feed f ON e.id_feed = f.id
     WHERE e.date BETWEEN ? AND ?
       AND (
-        {feed_name_conditions}
+        f.name IN ({placeholders})
         OR (f.category = ? AND f.url LIKE ?)
       )
     ORDER BY e.date DESC
     '''
     params = [start_ts, end_ts] + allowed_feed_names + [wechat_category_id, f'%{wechat_url_pattern}%']
 
-    cursor.execute(query_template, tuple(params))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    # Open read-only; FreshRSS may still be writing, so the DB is not marked immutable
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        cursor = conn.cursor()
+        # Read-only scan: map the file into memory, use a 64 MiB page cache,
+        # keep temp b-trees in memory and reject accidental writes
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA query_only=1")
+
+        cursor.arraysize = 1000
+        cursor.execute(query_template, tuple(params))
+        yield from cursor
+    finally:
+        conn.close()
 
 
 def fetch_articles_from_api(start_ts, end_ts):
@@ -215,32 +339,31 @@ def fetch_articles_from_api(start_ts, end_ts):
         print("Error: Failed to authenticate with FreshRSS API.")
         sys.exit(1)
 
-    # Fetch articles from all categories
-    all_articles = []
-    for category in categories:
-        print(f"Fetching articles from category '{category}'...")
-        articles = freshrss_api_get_articles(api_url, auth_token, category, start_ts, end_ts)
-        all_articles.extend(articles)
-        print(f"  Found {len(articles)} articles in '{category}'")
-
-    # Filter out excluded feeds
+    # Feeds to exclude are filtered out while parsing each page
     exclude_feeds_str = os.getenv("FRESHRSS_API_EXCLUDE_FEEDS", "")
-    if exclude_feeds_str:
-        exclude_feeds = set(f.strip() for f in exclude_feeds_str.split(',') if f.strip())
-        before_count = len(all_articles)
-        # feed_name is index 4 in tuple (link, title, content, date, feed_name)
-        all_articles = [a for a in all_articles if a[4] not in exclude_feeds]
-        excluded_count = before_count - len(all_articles)
-        if excluded_count > 0:
-            print(f"Excluded {excluded_count} articles from feeds: {', '.join(exclude_feeds)}")
+    exclude_feeds = frozenset(f.strip() for f in exclude_feeds_str.split(',') if f.strip())
+    if exclude_feeds:
+        print(f"Excluding articles from feeds: {', '.join(sorted(exclude_feeds))}")
+
+    # Fetch articles from all categories concurrently; each category's
+    # continuation chain stays sequential inside its own worker
+    print(f"Fetching articles from categories: {', '.join(categories)}...")
+    all_articles = []
+    with ThreadPoolExecutor(max_workers=len(categories)) as executor:
+        results = executor.map(
+            lambda category: freshrss_api_get_articles(api_url, auth_token, category, start_ts, end_ts, exclude_feeds),
+            categories,
+        )
+        for category, articles in zip(categories, results):
+            all_articles.extend(articles)
+            print(f"  Found {len(articles)} articles in '{category}'")
 
     # Sort by date descending (index 3 is date_val)
-    all_articles.sort(key=lambda x: x[3], reverse=True)
+    all_articles.sort(key=itemgetter(3), reverse=True)
     return all_articles
 
 
 def main():
-    load_dotenv()
     args = parse_args()
 
     # Compute time window
@@ -265,45 +388,56 @@ def main():
     elif db_path:
         # SQLite mode
         print("Using SQLite mode")
-        rows = fetch_articles_from_sqlite(db_path, start_ts, end_ts)
+        if args.create_indexes:
+            create_sqlite_indexes(db_path)
+        rows = iter_articles_from_sqlite(db_path, start_ts, end_ts)
     else:
         print("Error: No data source configured.")
         print("Set FRESHRSS_API_URL for API mode, or DB_PATH/--db for SQLite mode.")
         sys.exit(1)
 
-    if not rows:
+    # Peek at the first row so an empty result can be reported without
+    # materializing the whole (possibly streamed) result set
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
         print("No entries found in the specified time window.")
         sys.exit(0)
+    rows = itertools.chain([first], rows)
 
-    # Prepare output directory based on current timestamp
+    # Prepare output directory based on the run's start timestamp
     base_dir = "articles"
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    timestamp = now.strftime("%Y%m%d_%H%M")
     output_dir = os.path.join(base_dir, f"articles_{timestamp}")
     os.makedirs(output_dir, exist_ok=True)
     list_file = os.path.join(output_dir, "successful_articles.txt")
 
-    # Write each article as a text file and record the path
+    # Clean and write articles in parallel worker processes (HTML parsing is CPU-bound)
+    tasks = (
+        (idx, link, title, content, date_val, feed_name, output_dir)
+        for idx, (link, title, content, date_val, feed_name) in enumerate(rows, start=1)
+    )
+    max_workers = os.cpu_count() or 1
+    window = WRITE_CHUNKSIZE * max_workers
+    paths = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Executor.map submits its whole input up front, so feed it bounded
+        # windows of rows; the next window is queued before the previous one is
+        # drained so workers stay busy, keeping at most two windows in memory
+        pending = None
+        while True:
+            batch = list(itertools.islice(tasks, window))
+            current = executor.map(write_article, batch, chunksize=WRITE_CHUNKSIZE) if batch else None
+            if pending is not None:
+                paths.extend(pending)
+            if current is None:
+                break
+            pending = current
+
     with open(list_file, "w", encoding="utf-8") as list_f:
-        for idx, (link, title, content, date_val, feed_name) in enumerate(rows, start=1):
-            file_name = f"article_{idx}.txt"
-            file_path = os.path.join(output_dir, file_name)
-            # Clean HTML content
-            soup = BeautifulSoup(content or "", "html.parser")
-            text = soup.get_text().strip()
-            # Format date
-            try:
-                dt_str = datetime.fromtimestamp(date_val).strftime("%Y年%m月%d日")
-            except Exception:
-                dt_str = str(date_val)
-            # Write file
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(link + "\n\n")
-                f.write(title + "\n\n")
-                f.write(f"{feed_name} {dt_str}" + "\n\n")
-                f.write(text)
-            list_f.write(file_path + "\n")
-
-    print(f"Extracted {len(rows)} articles. List file: {list_file}")
+        list_f.write("\n".join(paths) + "\n")
+
+    print(f"Extracted {len(paths)} articles. List file: {list_file}")
 
 
 if __name__ == "__main__":
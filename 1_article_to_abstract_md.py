@@ -4,13 +4,14 @@
 import os
 import sys
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import math
 from datetime import datetime
-from dotenv import load_dotenv
+from common import RateLimiter, build_http_client, cached_dotenv, is_retryable_error, retry_delay
 import time
-from threading import Lock
+import heapq
 from pathlib import Path
 import re
+from types import SimpleNamespace
+from typing import Final
 
 try:
     from openai import OpenAI
@@ -18,41 +19,61 @@ except ImportError:
     print("请先安装相应的 SDK, 例如: pip install openai 或检查引用。")
     sys.exit(1)
 
-# 速率限制器实现
-class RateLimiter:
-    def __init__(self, max_per_minute=1000):
-        self.max_per_minute = max_per_minute
-        self.minute_count = 0
-        self.last_reset_minute = time.time()
-        self.lock = Lock()
-        
-    def acquire(self):
-        with self.lock:
-            current_time = time.time()
-            
-            # 检查是否需要重置分钟计数器
-            if current_time - self.last_reset_minute >= 60:
-                self.minute_count = 0
-                self.last_reset_minute = current_time
-            
-            # 检查是否超过限制
-            if self.minute_count >= self.max_per_minute:
-                sleep_time = 60 - (current_time - self.last_reset_minute)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                self.minute_count = 0
-                self.last_reset_minute = time.time()
-            
-            # 增加计数器
-            self.minute_count += 1
+SCRIPT_DIR = Path(__file__).parent
+
+# 从.env文件加载环境变量，并在模块加载时一次性读取配置
+cached_dotenv()
+
+
+def _parse_max_workers():
+    # 并发线程数，可通过环境变量覆盖，默认20
+    try:
+        return int(os.getenv("ABSTRACT_MAX_WORKERS", "20"))
+    except ValueError:
+        return 20
+
+
+# 使用 Gemini 端点与模型（OpenAI 兼容接口）。
+# 模型：优先从 Gemini_ABSTRACT_MODEL_ID 读取；未设置则回退到 Gemini_MODEL_ID；仍未设置则默认 gemini-3-flash-preview。
+_CFG: Final = SimpleNamespace(
+    api_key=os.getenv("Gemini_API_KEY"),
+    base_url=os.getenv("Gemini_BASE_URL"),
+    model_id=(
+        os.getenv("Gemini_ABSTRACT_MODEL_ID")
+        or os.getenv("Gemini_MODEL_ID")
+        or "gemini-3-flash-preview"
+    ),
+    max_workers=_parse_max_workers(),
+)
 
 # 创建全局限流器
 rate_limiter = RateLimiter()
 
-def generate_abstract_from_article(client, model_id, article_path, batch_idx, progress_callback=None):
+# 模型输出外层代码块围栏（```markdown ... ```），预编译并一次匹配首尾
+FENCE_RE = re.compile(r"\A```[a-zA-Z]*\n?(.*?)\n?```\s*\Z", re.DOTALL)
+OPEN_FENCE_RE = re.compile(r"\A```[a-zA-Z]*\n?")
+
+# 系统提示在模块加载时读取一次，所有工作线程共享
+with open(SCRIPT_DIR / "system_prompt" / "abstract_prompt.md", 'r', encoding='utf-8') as f:
+    SYSTEM_PROMPT = f.read()
+
+def read_article(article_path):
+    """
+    读取单篇文章内容。
+    
+    返回值： (文章内容 或 None, 错误信息或 None)
+    """
+    try:
+        with open(article_path, 'r', encoding='utf-8') as f:
+            return (f.read(), None)
+    except Exception as e:
+        return (None, f"无法读取文章文件 {article_path}: {str(e)}")
+
+
+def generate_abstract_from_article(client, model_id, article, article_idx, progress_callback=None):
     """
     用于并行调用 API 的辅助函数：
-    给定 client, model_id, article_path, 调用接口获取对应 Markdown 摘要。
+    给定 client, model_id 以及 read_article 预先读取的 article（(内容, 错误信息)），调用接口获取对应 Markdown 摘要。
     
     包含重试逻辑：如果发生错误，会自动重试最多3次。
     超过重试次数后，对错误情况返回None。
@@ -62,20 +83,13 @@ def generate_abstract_from_article(client, model_id, article_path, batch_idx, pr
     MAX_RETRIES = 3
     retry_count = 0
     
-    # 读取文章内容
-    try:
-        with open(article_path, 'r', encoding='utf-8') as f:
-            article_content = f.read()
-    except Exception as e:
-        error_message = f"无法读取文章文件 {article_path}: {str(e)}"
-        print(error_message)
+    # 文章内容已在提交任务前读取，这里只处理读取失败的情况
+    article_content, read_error = article
+    if read_error:
+        print(read_error)
         if progress_callback:
-            progress_callback(error_message)
-        return (batch_idx, None, error_message)
-    
-    # 读取系统提示文件
-    with open('./system_prompt/abstract_prompt.md', 'r', encoding='utf-8') as f:
-        prompt = f.read()
+            progress_callback(read_error)
+        return (article_idx, None, read_error)
     
     while retry_count < MAX_RETRIES:
         try:
@@ -85,7 +99,7 @@ def generate_abstract_from_article(client, model_id, article_path, batch_idx, pr
             completion = client.chat.completions.create(
                 model=model_id,
                 messages=[
-                    {"role": "system", "content": prompt},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": article_content},
                 ],
                 temperature=0.5
@@ -125,10 +139,11 @@ def generate_abstract_from_article(client, model_id, article_path, batch_idx, pr
 
             # 规范化输出：
             # 1) 去除可能的代码块围栏 ``` 或 ```markdown
-            if md_text.strip().startswith("```"):
-                # 去掉首尾围栏
-                md_text = re.sub(r"^```[a-zA-Z]*\n?", "", md_text.strip())
-                md_text = re.sub(r"\n?```\s*$", "", md_text)
+            stripped = md_text.strip()
+            if stripped.startswith("```"):
+                # 去掉首尾围栏；缺少结尾围栏时只去掉开头围栏
+                fence_match = FENCE_RE.match(stripped)
+                md_text = fence_match.group(1) if fence_match else OPEN_FENCE_RE.sub("", stripped, count=1)
             # 2) 如果包含 #，保留从第一个 # 开始，避免模型在前面添加说明
             if "#" in md_text and not md_text.lstrip().startswith('#'):
                 start_hash = md_text.find('#')
@@ -137,25 +152,34 @@ def generate_abstract_from_article(client, model_id, article_path, batch_idx, pr
             md_text = md_text.strip()
             # 结束：返回标准化后的摘要文本
             
-            return (batch_idx, md_text, None)
+            return (article_idx, md_text, None)
         
         except Exception as e:
             error_msg = str(e)
+            
+            # 4xx 等不可重试的错误直接放弃，避免浪费配额
+            if not is_retryable_error(e):
+                final_error_message = f"Article#{article_idx}: API调用出错: {error_msg}，错误不可重试，放弃处理此文章..."
+                print(final_error_message)
+                if progress_callback:
+                    progress_callback(final_error_message)
+                return (article_idx, None, error_msg)
+            
             retry_count += 1
             
-            retry_error_message = f"Article#{batch_idx}: API调用出错: {error_msg}，正在重试 ({retry_count}/{MAX_RETRIES})..."
+            retry_error_message = f"Article#{article_idx}: API调用出错: {error_msg}，正在重试 ({retry_count}/{MAX_RETRIES})..."
             print(retry_error_message)
             if progress_callback:
                 progress_callback(retry_error_message)
             
             if retry_count < MAX_RETRIES:
-                time.sleep(1)  # 延迟一秒后重试
+                time.sleep(retry_delay(retry_count))  # 指数退避加随机抖动，避免所有线程同时重试
             else:
-                final_error_message = f"Article#{batch_idx}: 已达到最大重试次数，放弃处理此文章..."
+                final_error_message = f"Article#{article_idx}: 已达到最大重试次数，放弃处理此文章..."
                 print(final_error_message)
                 if progress_callback:
                     progress_callback(final_error_message)
-                return (batch_idx, None, error_msg)
+                return (article_idx, None, error_msg)
 
 
 def main(input_articles_file, output_md=None, progress_callback=None):
@@ -171,37 +195,16 @@ def main(input_articles_file, output_md=None, progress_callback=None):
         output_md: 输出Markdown文件路径
         progress_callback: 进度回调函数，用于实时更新进度信息
     """
-    # 如果未指定输出文件，则使用默认路径和文件名
+    # 如果未指定输出文件，则使用默认路径和文件名（输出目录在开始写入前统一创建）
     if output_md is None:
-        # 确保输出目录存在
-        script_dir = Path(__file__).parent
-        output_dir = script_dir / "abstract_md"
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
         # 生成带时间戳的文件名
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_md = str(output_dir / f"abstract_md_{timestamp}.md")
+        output_md = str(SCRIPT_DIR / "abstract_md" / f"abstract_md_{timestamp}.md")
 
-    # 从.env文件加载环境变量
-    load_dotenv()
-    
-    # 使用 Gemini 端点与模型（OpenAI 兼容接口）。
-    # 模型：优先从 Gemini_ABSTRACT_MODEL_ID 读取；未设置则回退到 Gemini_MODEL_ID；仍未设置则默认 gemini-3-flash-preview。
-    api_key = os.getenv("Gemini_API_KEY")
-    model_id = (
-        os.getenv("Gemini_ABSTRACT_MODEL_ID")
-        or os.getenv("Gemini_MODEL_ID")
-        or "gemini-3-flash-preview"
-    )
-    base_url = os.getenv("Gemini_BASE_URL")
-    
-    # 并发线程数，可通过环境变量覆盖，默认20
-    try:
-        max_workers = int(os.getenv("ABSTRACT_MAX_WORKERS", "20"))
-    except ValueError:
-        max_workers = 20
-    batch_size = max_workers
+    api_key = _CFG.api_key
+    model_id = _CFG.model_id
+    base_url = _CFG.base_url
+    max_workers = _CFG.max_workers
     
     if not api_key:
         message = "未找到 Gemini_API_KEY 环境变量，请检查 .env 文件！"
@@ -217,8 +220,10 @@ def main(input_articles_file, output_md=None, progress_callback=None):
             progress_callback(message)
         sys.exit(1)
 
-    # 初始化客户端
-    client = OpenAI(base_url=base_url, api_key=api_key)
+    # 初始化客户端：所有工作线程共享同一个连接池（安装 h2 时使用 HTTP/2）
+    http_client = build_http_client(max_connections=max_workers * 2, timeout=120.0)
+    # 重试统一由 generate_abstract_from_article 处理，关闭 SDK 自带的重试，避免重试次数与退避叠加
+    client = OpenAI(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
 
     # 读取包含文章路径的文件
     if not os.path.exists(input_articles_file):
@@ -232,96 +237,110 @@ def main(input_articles_file, output_md=None, progress_callback=None):
         article_paths = [line.strip() for line in f if line.strip()]
 
     total_articles = len(article_paths)
-    total_batches = math.ceil(total_articles / batch_size)
-    message = f"\n开始处理，共{total_articles}篇文章，分{total_batches}批进行（每批{batch_size}篇）...\n"
+    message = f"\n开始处理，共{total_articles}篇文章，并发数{max_workers}...\n"
     print(message)
     if progress_callback:
         progress_callback(message)
 
-    # 并行调用 API
-    results = []  # 用于存放 (idx, md_text) 的结果
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for batch in range(total_batches):
-            start_idx = batch * batch_size
-            end_idx = min((batch + 1) * batch_size, total_articles)
-            batch_articles = article_paths[start_idx:end_idx]
-            current_batch_size = len(batch_articles)
-            remaining_batches = total_batches - batch - 1
-            
-            message = f"正在处理第{batch+1}批，共{current_batch_size}篇文章，还剩{remaining_batches}批"
-            print(message)
-            if progress_callback:
-                progress_callback(message)
-            
-            future_to_idx = {}
-            for i, article_path in enumerate(batch_articles):
-                future = executor.submit(
-                    generate_abstract_from_article, 
-                    client, 
-                    model_id, 
-                    article_path, 
-                    start_idx+i, 
+    # 预先批量读取全部文章，工作线程只负责网络请求
+    with ThreadPoolExecutor(max_workers=8) as reader:
+        articles = list(reader.map(read_article, article_paths))
+
+    # 确保输出目录存在
+    output_dir = os.path.dirname(output_md)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    # 并行调用 API：一次性提交全部文章，由线程池限制并发，避免按批等待最慢的文章。
+    # 结果按原先顺序 (idx) 边完成边写入 .md 文件：先完成的结果暂存在最小堆中，
+    # 轮到它时再写出，内存中只保留尚未轮到写入的结果。
+    success_count = 0
+    written_count = 0
+    pending = []  # (idx, md_text) 最小堆
+    next_idx = 0
+    # 先写入同目录下的临时文件，成功后再原子替换 output_md；
+    # 中断或没有有效内容时，已有的 output_md 保持不变
+    tmp_path = f"{output_md}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out_f, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_idx = {
+                executor.submit(
+                    generate_abstract_from_article,
+                    client,
+                    model_id,
+                    article,
+                    i,
                     progress_callback
-                )
-                future_to_idx[future] = start_idx+i
+                ): i
+                for i, article in enumerate(articles)
+            }
 
-            for future in as_completed(future_to_idx):
+            for done_count, future in enumerate(as_completed(future_to_idx), start=1):
                 idx = future_to_idx[future]
+                md_text = None
                 try:
-                    (ret_idx, md_text, err_msg) = future.result()
+                    (_, md_text, err_msg) = future.result()
                     if err_msg:
                         error_message = f"错误: {err_msg}"
                         print(error_message)
                         if progress_callback:
                             progress_callback(error_message)
-                        continue
-                    results.append((ret_idx, md_text))
+                    else:
+                        success_count += 1
                 except Exception as e:
                     error_message = f"错误: {e}"
                     print(error_message)
                     if progress_callback:
                         progress_callback(error_message)
 
-            batch_complete_message = f"第{batch+1}批处理完成"
-            print(batch_complete_message)
-            if progress_callback:
-                progress_callback(batch_complete_message)
+                # 失败的文章以空内容入堆，保证后续结果仍能按顺序写出
+                heapq.heappush(pending, (idx, md_text or ""))
+                while pending and pending[0][0] == next_idx:
+                    _, text = heapq.heappop(pending)
+                    text = text.strip()
+                    if text:
+                        if written_count:
+                            out_f.write("\n\n")
+                        out_f.write(text)
+                        written_count += 1
+                    next_idx += 1
 
-    completion_message = f"\n全部处理完成，成功处理 {len(results)}/{total_articles} 篇文章\n"
+                # 每完成 max_workers 篇（以及全部完成时）报告一次进度
+                if done_count % max_workers == 0 or done_count == total_articles:
+                    message = f"已完成 {done_count}/{total_articles} 篇文章"
+                    print(message)
+                    if progress_callback:
+                        progress_callback(message)
+        if written_count:
+            os.replace(tmp_path, output_md)
+    except OSError as e:
+        error_message = f"写入文件失败: {e}"
+        print(error_message)
+        if progress_callback:
+            progress_callback(error_message)
+        return
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    completion_message = f"\n全部处理完成，成功处理 {success_count}/{total_articles} 篇文章\n"
     print(completion_message)
     if progress_callback:
         progress_callback(completion_message)
 
-    # 按照原先顺序 (idx) 排序并合并所有 Markdown
-    results.sort(key=lambda x: x[0])
-    merged_md = "\n\n".join((r[1].strip() if r[1] else "") for r in results if r[1] and r[1].strip())
-
-    if not merged_md.strip():
+    if not written_count:
         empty_message = "未获取到任何有效内容，程序结束。"
         print(empty_message)
         if progress_callback:
             progress_callback(empty_message)
         return
 
-    # 将合并后的 Markdown 内容写入 .md 文件
-    try:
-        # 确保输出目录存在
-        output_dir = os.path.dirname(output_md)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            
-        with open(output_md, "w", encoding="utf-8") as f:
-            f.write(merged_md)
-        file_message = f"已生成Markdown文件：{output_md}"
-        print(file_message)
-        if progress_callback:
-            progress_callback(file_message)
-        return output_md
-    except Exception as e:
-        error_message = f"写入文件失败: {e}"
-        print(error_message)
-        if progress_callback:
-            progress_callback(error_message)
+    file_message = f"已生成Markdown文件：{output_md}"
+    print(file_message)
+    if progress_callback:
+        progress_callback(file_message)
+    return output_md
 
 if __name__ == "__main__":
     """
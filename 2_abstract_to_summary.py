@@ -3,15 +3,20 @@
 """
 Generate final summary from abstract Markdown file using Google Gemini API.
 Usage:
-    python 2_abstract_to_summary.py --input-md <ABSTRACT_MD> [--output-md <DELIVERABLE_MD>]
+    python 2_abstract_to_summary.py --input-md <ABSTRACT_MD> [<ABSTRACT_MD> ...] [--output-md <DELIVERABLE_MD>]
 """
+import io
 import os
 import sys
 import re
 import argparse
+import functools
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from dotenv import load_dotenv
+from types import SimpleNamespace
+from typing import Final
+from common import RateLimiter, build_http_client, cached_dotenv, is_retryable_error, retry_delay
 
 try:
     from openai import OpenAI
@@ -19,125 +24,229 @@ except ImportError:
     print("Please install openai sdk: pip install openai")
     sys.exit(1)
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Load .env once at import and resolve configuration up front
+cached_dotenv()
+
+
+def _parse_rps():
+    try:
+        rps = float(os.getenv("GEMINI_RPS", "0"))
+    except ValueError:
+        return None
+    return rps if rps > 0 else None
+
+
+# 模型：优先从 Gemini_SUMMARY_MODEL_ID 读取；未设置则回退到 Gemini_MODEL_ID；仍未设置则默认 gemini-3-pro-preview。
+_CFG: Final = SimpleNamespace(
+    api_key=os.getenv("Gemini_API_KEY"),
+    base_url=os.getenv("Gemini_BASE_URL"),
+    model_id=os.getenv("Gemini_SUMMARY_MODEL_ID") or os.getenv("Gemini_MODEL_ID") or "gemini-3-pro-preview",
+    # Optional cap on summary length; unset means no limit
+    max_tokens=int(os.getenv("SUMMARY_MAX_TOKENS")) if os.getenv("SUMMARY_MAX_TOKENS", "").isdigit() else None,
+    # Optional requests-per-second limit for summary calls; unset means no limit
+    rps=_parse_rps(),
+)
+
+# Per-request read timeout (seconds); summaries over a week of abstracts can take minutes
+SUMMARY_TIMEOUT: Final = 600.0
+
+# Max concurrent summary requests when several abstracts are summarized at once
+SUMMARY_MAX_WORKERS: Final = 4
+
+# Connection pool size for the shared HTTP client
+SUMMARY_MAX_CONNECTIONS: Final = 32
+
+# Article header for clean_abstract_md: "### [title](url)" or, failing that, "### title"
+_HEADER_RE = re.compile(r'^### (?:\[(?P<title>.+?)\]\((?P<url>.+?)\)|(?P<titleonly>.+?))\s*$')
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Generate final summary from abstract MD")
-    parser.add_argument("--input-md", "-i", required=True, help="Path to abstract markdown file")
+    parser.add_argument("--input-md", "-i", required=True, nargs="+", help="Path(s) to abstract markdown file(s)")
     parser.add_argument("--output-md", "-o", help="Path to output deliverable markdown file")
     return parser.parse_args()
 
-def generate_summary(client, model_id, markdown_content):
+@functools.lru_cache(maxsize=1)
+def _load_summary_prompt():
+    """Read the summary system prompt once; later calls reuse the cached text."""
+    prompt_path = os.path.join(SCRIPT_DIR, "system_prompt/summary_prompt.md")
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def generate_summary(client, model_id, markdown_content, rate_limiter=None):
+    """Return the summary text, or None if the API call failed for good."""
     MAX_RETRIES = 5
     retry_count = 0
-    prompt_path = os.path.join(os.path.dirname(__file__), "system_prompt/summary_prompt.md")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        prompt = f.read()
+    prompt = _load_summary_prompt()
+    extra_args = {}
+    if _CFG.max_tokens:
+        # Bound response length (and cost) when configured
+        extra_args["max_tokens"] = _CFG.max_tokens
     while retry_count < MAX_RETRIES:
         try:
+            if rate_limiter:
+                rate_limiter.acquire()
             completion = client.chat.completions.create(
                 model=model_id,
                 messages=[
                     {"role": "system", "content": prompt},
                     {"role": "user", "content": markdown_content},
                 ],
-                temperature=0.5
+                temperature=0.5,
+                **extra_args
             )
             return completion.choices[0].message.content
         except Exception as e:
+            if not is_retryable_error(e):
+                print(f"Error calling API: {e} (not retryable), giving up.")
+                return None
             retry_count += 1
             print(f"Error calling API: {e}, retry {retry_count}/{MAX_RETRIES}")
-            time.sleep(1)
-    print("Max retries reached, exiting.")
-    sys.exit(1)
+            if retry_count < MAX_RETRIES:
+                time.sleep(retry_delay(retry_count, cap=60.0))
+    print("Max retries reached, giving up.")
+    return None
+
+def generate_summaries(client, model_id, contents, max_workers=SUMMARY_MAX_WORKERS):
+    """
+    Summarize several abstract documents concurrently with one shared client.
+    Calls are throttled by a token bucket when GEMINI_RPS is set.
+    Returns summaries in the same order as contents, with None for failures.
+    """
+    rate_limiter = RateLimiter(max_per_minute=_CFG.rps * 60, burst=1) if _CFG.rps else None
+    if len(contents) == 1:
+        return [generate_summary(client, model_id, contents[0], rate_limiter)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(contents))) as executor:
+        return list(executor.map(lambda content: generate_summary(client, model_id, content, rate_limiter), contents))
+
+def _deliverable_paths(input_mds, deliverable_dir, today):
+    """One deliverable path per input, named after its file; repeated names get a (2), (3), ... suffix."""
+    if len(input_mds) == 1:
+        return [os.path.join(deliverable_dir, f"AI News Update {today}.md")]
+    paths = []
+    name_counts = {}
+    for input_md in input_mds:
+        stem = os.path.splitext(os.path.basename(input_md))[0]
+        name_counts[stem] = name_counts.get(stem, 0) + 1
+        suffix = f" ({name_counts[stem]})" if name_counts[stem] > 1 else ""
+        paths.append(os.path.join(deliverable_dir, f"AI News Update {today} - {stem}{suffix}.md"))
+    return paths
+
+def _iter_lines(text):
+    """Yield the lines of text one at a time, like text.split('\n') without building the list."""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
 
 def clean_abstract_md(content):
     """Clean abstract markdown: remove skip markers and deduplicate articles."""
-    lines = content.split('\n')
-    cleaned_lines = []
     seen_keys = set()  # Track both titles and URLs
-    current_article = []
-    current_key = None
+    keep = True  # Lines before first article header are always kept
+    buf = io.StringIO()
+    blank_run = 0
 
-    for line in lines:
-        # Skip lines containing skip markers
-        if '[跳过：' in line or '[跳过:' in line:
+    # Single pass: each article is kept or dropped at its header and its lines
+    # are written straight out, collapsing runs of empty lines to a single one
+    # as we go (at most two consecutive newlines)
+    for line in _iter_lines(content):
+        # Both skip-marker variants share the '[跳过' prefix; most lines fail that one scan
+        if '[跳过' in line and ('[跳过：' in line or '[跳过:' in line):
             continue
 
-        # Detect article title with URL: ### [...](url)
-        url_match = re.match(r'^### \[(.+?)\]\((.+?)\)\s*$', line)
-        # Detect article title without URL: ### title
-        title_only_match = re.match(r'^### (.+?)\s*$', line) if not url_match else None
-
-        if url_match or title_only_match:
-            # Save previous article if exists and not duplicate
-            if current_key and current_key not in seen_keys:
-                cleaned_lines.extend(current_article)
-                seen_keys.add(current_key)
-
-            # Start new article - use URL as key if available, otherwise title
-            if url_match:
-                url = url_match.group(2).strip()
-                current_key = url  # Dedupe by URL
-            else:
-                current_key = title_only_match.group(1).strip()  # Dedupe by title
-            current_article = [line]
-        else:
-            if current_key is not None:
-                current_article.append(line)
-            else:
-                # Lines before first article header
-                cleaned_lines.append(line)
-
-    # Don't forget the last article
-    if current_key and current_key not in seen_keys:
-        cleaned_lines.extend(current_article)
+        # Detect article title with or without URL: ### [...](url) / ### title
+        # (cheap prefix check first; most lines are body text)
+        header_match = _HEADER_RE.match(line) if line.startswith('### ') else None
+        if header_match:
+            # Dedupe by URL if available, otherwise by title
+            key = (header_match.group('url') or header_match.group('titleonly')).strip()
+            keep = bool(key) and key not in seen_keys
+            if keep:
+                seen_keys.add(key)
+        if not keep:
+            continue
 
-    # Remove consecutive empty lines (keep at most 2)
-    result = '\n'.join(cleaned_lines)
-    result = re.sub(r'\n{3,}', '\n\n', result)
-    return result.strip()
+        if line:
+            blank_run = 0
+        else:
+            blank_run += 1
+            if blank_run > 1:
+                continue
+        buf.write(line)
+        buf.write('\n')
+    return buf.getvalue().strip()
 
 
 def main():
     args = parse_args()
-    if not os.path.exists(args.input_md):
-        print(f"Error: input file '{args.input_md}' does not exist.")
+    if args.output_md and len(args.input_md) > 1:
+        print("Error: --output-md can only be used with a single --input-md.")
         sys.exit(1)
-    with open(args.input_md, "r", encoding="utf-8") as f:
-        abstract_md = f.read()
-
-    # Clean abstract: remove skip markers and deduplicate
-    abstract_md = clean_abstract_md(abstract_md)
+    abstracts = []
+    for input_md in args.input_md:
+        if not os.path.exists(input_md):
+            print(f"Error: input file '{input_md}' does not exist.")
+            sys.exit(1)
+        with open(input_md, "r", encoding="utf-8") as f:
+            abstract_md = f.read()
+        # Clean abstract: remove skip markers and deduplicate
+        abstracts.append(clean_abstract_md(abstract_md))
     print(f"Cleaned abstract markdown")
-    load_dotenv()
-    api_key = os.getenv("Gemini_API_KEY")
-    # 模型：优先从 Gemini_SUMMARY_MODEL_ID 读取；未设置则回退到 Gemini_MODEL_ID；仍未设置则默认 gemini-3-pro-preview。
-    model_id = os.getenv("Gemini_SUMMARY_MODEL_ID") or os.getenv("Gemini_MODEL_ID") or "gemini-3-pro-preview"
-    base_url = os.getenv("Gemini_BASE_URL")
+    api_key = _CFG.api_key
+    model_id = _CFG.model_id
+    base_url = _CFG.base_url
     if not api_key:
         print("Missing Gemini_API_KEY in environment.")
         sys.exit(1)
     if not base_url:
         print("Missing Gemini_BASE_URL in environment.")
         sys.exit(1)
-    client = OpenAI(api_key=api_key, base_url=base_url)
-    print("Generating summary...")
-    summary_text = generate_summary(client, model_id, abstract_md)
-    # Prepare deliverable
+    # Retries are handled by generate_summary, so disable the SDK's own retries;
+    # the timeout keeps a hung call from stalling the pipeline indefinitely.
+    # One pooled (HTTP/2 when available) client is shared by all summary calls.
+    client = OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=build_http_client(SUMMARY_MAX_CONNECTIONS, timeout=SUMMARY_TIMEOUT),
+        max_retries=0,
+    )
+    print("Generating summary..." if len(abstracts) == 1 else f"Generating {len(abstracts)} summaries...")
+    summaries = generate_summaries(client, model_id, abstracts)
+    # Prepare deliverables
     deliverable_dir = os.path.join(os.getcwd(), "deliverable")
     os.makedirs(deliverable_dir, exist_ok=True)
-    today = datetime.now().strftime("%Y %m %d")
-    display_date = datetime.now().strftime("%Y/%m/%d")
-    filename = f"AI News Update {today}.md"
-    output_path = args.output_md if args.output_md else os.path.join(deliverable_dir, filename)
-    deliverable_content = (
-        f"# AI News Update - {display_date}\n\n"
-        f"## Weekly Summary\n\n{summary_text}\n\n---\n\n"
-        f"## News Abstracts\n\n{abstract_md}"
-    )
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(deliverable_content)
-    print(f"Deliverable saved to {output_path}")
-    return output_path
+    now = datetime.now()
+    today = now.strftime("%Y %m %d")
+    display_date = now.strftime("%Y/%m/%d")
+    if args.output_md:
+        target_paths = [args.output_md]
+    else:
+        target_paths = _deliverable_paths(args.input_md, deliverable_dir, today)
+    output_paths = []
+    failed = []
+    for input_md, output_path, abstract_md, summary_text in zip(args.input_md, target_paths, abstracts, summaries):
+        if summary_text is None:
+            # Keep the other deliverables; report the failure once all are written
+            failed.append(input_md)
+            continue
+        # Write the pieces in sequence rather than building one combined string
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(f"# AI News Update - {display_date}\n\n## Weekly Summary\n\n")
+            f.write(summary_text)
+            f.write("\n\n---\n\n## News Abstracts\n\n")
+            f.write(abstract_md)
+        print(f"Deliverable saved to {output_path}")
+        output_paths.append(output_path)
+    if failed:
+        print(f"Error: failed to summarize {', '.join(failed)}")
+        sys.exit(1)
+    return output_paths
 
 if __name__ == "__main__":
     main() 
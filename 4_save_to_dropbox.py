@@ -1,24 +1,68 @@
 import argparse
+import mmap
 import os
 import subprocess
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from threading import Semaphore
+from types import SimpleNamespace
+from typing import Final
 import dropbox
-from dotenv import load_dotenv
+from common import cached_dotenv
 
+# Load .env once at import and resolve configuration up front
+cached_dotenv()
 
-def upload_via_rclone(file_path, dest_path):
-    """Uploads a file using rclone."""
+_CFG: Final = SimpleNamespace(
+    rclone_md_dest=os.getenv("RCLONE_MD_DEST"),
+    rclone_pdf_dest=os.getenv("RCLONE_PDF_DEST"),
+    app_key=os.getenv("DROPBOX_APP_KEY"),
+    app_secret=os.getenv("DROPBOX_APP_SECRET"),
+    refresh_token=os.getenv("DROPBOX_REFRESH_TOKEN"),
+)
+
+# Files above this size upload their chunks concurrently instead of one after another
+SINGLE_UPLOAD_LIMIT: Final = 150 * 1024 * 1024
+# Session chunk size; concurrent sessions need every chunk but the last to be a multiple of 4 MiB
+CHUNK_SIZE: Final = 16 * 1024 * 1024
+# Parallel append_v2 calls per upload session
+CHUNK_WORKERS: Final = 4
+# Parallel small-file uploads feeding the batch commit
+BATCH_WORKERS: Final = 8
+# Max entries per files_upload_session_finish_batch_v2 call
+BATCH_MAX_ENTRIES: Final = 1000
+# Caps in-flight upload requests across all threads to stay clear of 429s
+API_SEMAPHORE: Final = Semaphore(12)
+# Parallel transfers within one rclone process
+RCLONE_TRANSFERS: Final = 8
+
+
+def upload_via_rclone(file_paths, dest_path):
+    """
+    Uploads files that share a source directory using one rclone process.
+    The basenames go in a --files-from-raw list so rclone batches the
+    transfers over a single connection pool.
+    """
+    src_dir = os.path.dirname(os.path.abspath(file_paths[0]))
+    file_names = [os.path.basename(file_path) for file_path in file_paths]
+    dest = dest_path.rstrip('/')
+    list_path = None
     try:
-        file_name = os.path.basename(file_path)
-        full_dest = f"{dest_path.rstrip('/')}/{file_name}"
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as list_file:
+            list_file.write("\n".join(file_names) + "\n")
+            list_path = list_file.name
 
         result = subprocess.run(
-            ["rclone", "copyto", file_path, full_dest],
+            ["rclone", "copy", "--files-from-raw", list_path, "--transfers", str(RCLONE_TRANSFERS), src_dir, dest],
             capture_output=True,
             text=True
         )
 
         if result.returncode == 0:
-            print(f"Successfully uploaded {file_name} via rclone to: {full_dest}")
+            for file_name in file_names:
+                print(f"Successfully uploaded {file_name} via rclone to: {dest}/{file_name}")
             return True
         else:
             print(f"*** rclone error: {result.stderr}")
@@ -27,34 +71,85 @@ def upload_via_rclone(file_path, dest_path):
         print("*** Error: rclone is not installed or not in PATH")
         return False
     except Exception as e:
-        print(f"*** Error uploading {file_path} via rclone: {e}")
+        print(f"*** Error uploading {', '.join(file_paths)} via rclone: {e}")
         return False
+    finally:
+        if list_path:
+            os.remove(list_path)
+
+
+def map_file(f, total_size):
+    """Maps f read-only for slicing chunks; an empty file can't be mapped, so it maps to b''."""
+    if total_size == 0:
+        return nullcontext(b'')
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def upload_chunked(file_path, dbx, total_size):
+    """
+    Uploads a large file through a concurrent upload session and returns its session id.
+    Chunks are appended in parallel at explicit offsets; the session is
+    started without data so a retried start resends nothing.
+    """
+    session_id = dbx.files_upload_session_start(
+        b'', session_type=dropbox.files.UploadSessionType.concurrent).session_id
+    offsets = range(0, total_size, CHUNK_SIZE)
+
+    with open(file_path, "rb") as f, map_file(f, total_size) as mm:
+
+        def append_chunk(offset, close=False):
+            # Slicing the shared map at explicit offsets keeps workers
+            # independent of any file position; each slice is a bytes copy
+            data = mm[offset:offset + CHUNK_SIZE]
+            cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=offset)
+            with API_SEMAPHORE:
+                dbx.files_upload_session_append_v2(data, cursor, close=close)
+
+        with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as executor:
+            # list() waits for every chunk and re-raises the first failed append
+            list(executor.map(append_chunk, offsets[:-1]))
+
+        # A concurrent session must be closed by its final chunk, and a closed
+        # session rejects further appends, so send it only after all the others
+        append_chunk(offsets[-1], close=True)
+
+    return session_id
+
 
+def upload_sequential(file_path, dbx, total_size):
+    """Uploads a small file through a regular upload session and returns its session id."""
+    with API_SEMAPHORE:
+        session_id = dbx.files_upload_session_start(b'').session_id
+    with open(file_path, "rb") as f, map_file(f, total_size) as mm:
+        # The SDK only accepts bytes (no mmap or file objects), so slice one
+        # chunk at a time to keep each worker's peak memory at CHUNK_SIZE
+        for offset in range(0, max(total_size, 1), CHUNK_SIZE):
+            data = mm[offset:offset + CHUNK_SIZE]
+            cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=offset)
+            with API_SEMAPHORE:
+                dbx.files_upload_session_append_v2(data, cursor, close=offset + CHUNK_SIZE >= total_size)
+    return session_id
 
-def upload_to_dropbox(file_path, dbx):
-    """Uploads a file to Dropbox via API."""
+
+def upload_to_dropbox(file_path, dbx, total_size=None):
+    """
+    Uploads a file's bytes into a closed upload session without committing it.
+    Returns the UploadSessionFinishArg for commit_to_dropbox, or None on failure.
+    total_size saves a stat when the caller already has it.
+    """
     try:
         file_name = os.path.basename(file_path)
-        dropbox_path = f"/{file_name}"
-        with open(file_path, "rb") as f:
-            # Check file size, if > 150MB, use upload_session
-            if os.path.getsize(file_path) > 150 * 1024 * 1024:
-                print(f"File {file_name} is larger than 150MB, using chunked upload.")
-                upload_session_start_result = dbx.files_upload_session_start(f.read(150 * 1024 * 1024))
-                cursor = dropbox.files.UploadSessionCursor(session_id=upload_session_start_result.session_id,
-                                                           offset=f.tell())
-                commit = dropbox.files.CommitInfo(path=dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
-
-                while f.tell() < os.path.getsize(file_path):
-                    if (os.path.getsize(file_path) - f.tell()) <= 150 * 1024 * 1024:
-                        dbx.files_upload_session_finish(f.read(150 * 1024 * 1024), cursor, commit)
-                    else:
-                        dbx.files_upload_session_append_v2(f.read(150 * 1024 * 1024), cursor)
-                        cursor.offset = f.tell()
-            else:
-                 dbx.files_upload(f.read(), dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
-
-        print(f"Successfully uploaded {file_name} to Dropbox path: {dropbox_path}")
+        if total_size is None:
+            total_size = os.path.getsize(file_path)
+        # Check file size, if > 150MB, upload chunks concurrently
+        if total_size > SINGLE_UPLOAD_LIMIT:
+            print(f"File {file_name} is larger than 150MB, using chunked upload.")
+            session_id = upload_chunked(file_path, dbx, total_size)
+        else:
+            session_id = upload_sequential(file_path, dbx, total_size)
+        cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=total_size)
+        commit = dropbox.files.CommitInfo(path=f"/{file_name}", mode=dropbox.files.WriteMode('overwrite'))
+        return dropbox.files.UploadSessionFinishArg(cursor=cursor, commit=commit)
     except dropbox.exceptions.ApiError as err:
         print(f"*** Dropbox API error: {err}")
         return None
@@ -63,14 +158,28 @@ def upload_to_dropbox(file_path, dbx):
         return None
 
 
+def commit_to_dropbox(entries, dbx):
+    """Commits uploaded sessions together with finish_batch_v2 instead of one commit per file."""
+    for i in range(0, len(entries), BATCH_MAX_ENTRIES):
+        batch = entries[i:i + BATCH_MAX_ENTRIES]
+        try:
+            # finish_batch_v2 commits synchronously, so there is no job to poll
+            result = dbx.files_upload_session_finish_batch_v2(batch)
+        except dropbox.exceptions.ApiError as err:
+            print(f"*** Dropbox API error: {err}")
+            continue
+        for entry, status in zip(batch, result.entries):
+            if status.is_success():
+                print(f"Successfully uploaded {os.path.basename(entry.commit.path)} to Dropbox path: {entry.commit.path}")
+            else:
+                print(f"*** Dropbox API error for {entry.commit.path}: {status.get_failure()}")
+
+
 def main():
     """Main function to handle argument parsing and file uploads."""
-    # Load environment variables from .env file
-    load_dotenv()
-
     # Check for rclone configuration
-    rclone_md_dest = os.getenv("RCLONE_MD_DEST")
-    rclone_pdf_dest = os.getenv("RCLONE_PDF_DEST")
+    rclone_md_dest = _CFG.rclone_md_dest
+    rclone_pdf_dest = _CFG.rclone_pdf_dest
     use_rclone = rclone_md_dest or rclone_pdf_dest
 
     # Setup argument parser
@@ -81,6 +190,8 @@ def main():
     # Use rclone if configured
     if use_rclone:
         print("Using rclone for upload...")
+        # Group by (source dir, destination) so each group is one rclone invocation
+        groups = defaultdict(list)
         for file_path in args.files:
             if not os.path.exists(file_path):
                 print(f"File not found: {file_path}")
@@ -88,25 +199,28 @@ def main():
 
             # Determine destination based on file extension
             if file_path.endswith('.md'):
-                if rclone_md_dest:
-                    upload_via_rclone(file_path, rclone_md_dest)
-                else:
+                if not rclone_md_dest:
                     print(f"Skipping {file_path}: RCLONE_MD_DEST not configured")
+                    continue
+                dest = rclone_md_dest
             elif file_path.endswith('.pdf'):
-                if rclone_pdf_dest:
-                    upload_via_rclone(file_path, rclone_pdf_dest)
-                else:
+                if not rclone_pdf_dest:
                     print(f"Skipping {file_path}: RCLONE_PDF_DEST not configured")
+                    continue
+                dest = rclone_pdf_dest
             else:
                 # For other file types, use MD dest as default, or PDF dest as fallback
                 dest = rclone_md_dest or rclone_pdf_dest
-                upload_via_rclone(file_path, dest)
+            groups[(os.path.dirname(os.path.abspath(file_path)), dest)].append(file_path)
+
+        for (_, dest), file_paths in groups.items():
+            upload_via_rclone(file_paths, dest)
         return
 
     # Fall back to Dropbox API
-    app_key = os.getenv("DROPBOX_APP_KEY")
-    app_secret = os.getenv("DROPBOX_APP_SECRET")
-    refresh_token = os.getenv("DROPBOX_REFRESH_TOKEN")
+    app_key = _CFG.app_key
+    app_secret = _CFG.app_secret
+    refresh_token = _CFG.refresh_token
 
     if not all([app_key, app_secret, refresh_token]):
         print("Error: Either configure RCLONE_MD_DEST/RCLONE_PDF_DEST for rclone, or DROPBOX_APP_KEY, DROPBOX_APP_SECRET, and DROPBOX_REFRESH_TOKEN for Dropbox API.")
@@ -124,11 +238,28 @@ def main():
         print(f"Error connecting to Dropbox: {e}")
         return
 
+    entries = []
+    small_files = []
     for file_path in args.files:
-        if os.path.exists(file_path):
-            upload_to_dropbox(file_path, dbx)
-        else:
+        # One stat per file; the size is passed down instead of re-read per chunk
+        try:
+            total_size = os.path.getsize(file_path)
+        except OSError:
             print(f"File not found: {file_path}")
+            continue
+        if total_size > SINGLE_UPLOAD_LIMIT:
+            # Large files already append their chunks in parallel, so take them one at a time
+            entries.append(upload_to_dropbox(file_path, dbx, total_size))
+        else:
+            small_files.append((file_path, total_size))
+
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+        entries.extend(executor.map(lambda item: upload_to_dropbox(item[0], dbx, item[1]), small_files))
+
+    # All files share one batch commit instead of one commit each
+    entries = [entry for entry in entries if entry]
+    if entries:
+        commit_to_dropbox(entries, dbx)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
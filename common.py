@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the pipeline scripts.
+"""
+import json
+import os
+import random
+import time
+from pathlib import Path
+from threading import Lock
+
+PROJECT_DIR = Path(__file__).resolve().parent
+ENV_PATH = PROJECT_DIR / ".env"
+ENV_CACHE_PATH = PROJECT_DIR / ".env.cache.json"
+
+
+def cached_dotenv(path=ENV_PATH, cache_path=ENV_CACHE_PATH):
+    """
+    Load variables from .env into os.environ, like load_dotenv().
+    The parsed values are cached in .env.cache.json keyed by the .env mtime,
+    so .env is only re-parsed after it changes.
+    Existing environment variables are never overridden.
+    Returns True if a .env file was found.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+
+    env = None
+    try:
+        cache = json.loads(Path(cache_path).read_text(encoding="utf-8"))
+        if cache.get("path") == str(path) and cache.get("mtime") == mtime:
+            env = cache["env"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if env is None:
+        from dotenv import dotenv_values
+
+        env = {key: value for key, value in dotenv_values(path).items() if value is not None}
+        try:
+            # The cache holds secrets, so keep it private to the current user
+            fd = os.open(cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            # The mode above only applies on creation; tighten an existing file too
+            if hasattr(os, "fchmod"):
+                os.fchmod(fd, 0o600)
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump({"path": str(path), "mtime": mtime, "env": env}, f)
+        except OSError as e:
+            print(f"Warning: could not write env cache {cache_path}: {e}")
+
+    for key, value in env.items():
+        os.environ.setdefault(key, value)
+    return True
+
+
+def build_http_client(max_connections, timeout=60.0, connect_timeout=10.0):
+    """
+    Build an httpx.Client to share across worker threads via OpenAI(http_client=...).
+    Uses HTTP/2 when the optional h2 package is installed so concurrent requests
+    multiplex over one connection, and sizes the pool so threads don't wait for
+    a free connection.
+    """
+    import httpx
+
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+
+    return httpx.Client(
+        http2=http2,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+    )
+
+
+def is_retryable_error(error):
+    """
+    Decide whether a failed API call is worth retrying.
+    4xx responses (bad request, auth, not found, ...) are permanent, except
+    408/409/429; 5xx, timeouts, connection errors and malformed responses are retried.
+    """
+    from openai import APIStatusError
+
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return True
+
+
+def retry_delay(retry_count, cap=30.0):
+    """Exponential backoff with jitter so concurrent workers don't retry in lockstep."""
+    return min(cap, (2 ** retry_count) + random.uniform(0, 1))
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiting API calls to max_per_minute.
+    burst is the bucket capacity (defaults to max_per_minute); waiting threads
+    sleep outside the lock so other threads can proceed once tokens refill.
+    """
+
+    def __init__(self, max_per_minute=1000, burst=None):
+        self.max_per_minute = max_per_minute
+        self.capacity = float(burst if burst is not None else max_per_minute)
+        self.rate = max_per_minute / 60.0  # tokens added per second
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # Refill for the elapsed time, up to the bucket capacity
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            # Sleep without holding the lock so other threads aren't blocked
+            time.sleep(wait)
@@ -57,7 +57,7 @@ echo "Cleanup complete."
 # =============================================================================
 
 echo "Syncing dependencies with uv..."
-uv sync
+uv sync --extra fast
 
 echo "Step 1: Extracting articles..."
 if [[ -n "$API_MODE" ]]; then
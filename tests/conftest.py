@@ -0,0 +1,27 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# The scripts import the shared helpers as a top-level module
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(scope="session")
+def load_script():
+    """Return a loader that imports a numbered pipeline script (e.g. "2_abstract_to_summary.py")."""
+    # The scripts exit at import when the openai SDK is missing
+    pytest.importorskip("openai")
+    modules = {}
+
+    def load(filename):
+        if filename not in modules:
+            spec = importlib.util.spec_from_file_location(Path(filename).stem, ROOT / filename)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            modules[filename] = module
+        return modules[filename]
+
+    return load
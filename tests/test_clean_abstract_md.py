@@ -0,0 +1,53 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def clean(load_script):
+    return load_script("2_abstract_to_summary.py").clean_abstract_md
+
+
+def test_skip_marker_lines_are_removed(clean):
+    content = "### [A](http://a)\n[跳过：not AI news]\nbody\n[跳过: also skipped]\nend"
+    assert clean(content) == "### [A](http://a)\nbody\nend"
+
+
+def test_bare_skip_tag_is_kept(clean):
+    # Only "[跳过：" / "[跳过:" mark skipped articles
+    content = "### [A](http://a)\n[跳过] is mentioned here"
+    assert clean(content) == content
+
+
+def test_url_and_title_only_headers_are_both_kept(clean):
+    content = "### [A](http://a)\nfirst\n\n### Title only\nsecond"
+    assert clean(content) == content
+
+
+def test_duplicate_url_is_dropped(clean):
+    # URL headers are keyed by URL, so a different title doesn't matter
+    content = "### [A](http://a)\nfirst\n### [B](http://a)\nduplicate\n### [C](http://c)\nthird"
+    assert clean(content) == "### [A](http://a)\nfirst\n### [C](http://c)\nthird"
+
+
+def test_duplicate_title_is_dropped(clean):
+    content = "### Same title\nfirst\n### Same title  \nduplicate\n### Other\nsecond"
+    assert clean(content) == "### Same title\nfirst\n### Other\nsecond"
+
+
+def test_empty_key_header_is_dropped(clean):
+    content = "### [A](http://a)\nkept\n###  \nno title\n### [B]( )\nblank url\n### [C](http://c)\nkept too"
+    assert clean(content) == "### [A](http://a)\nkept\n### [C](http://c)\nkept too"
+
+
+def test_preamble_before_first_header_is_kept(clean):
+    content = "Intro line\n\n### [A](http://a)\nbody"
+    assert clean(content) == content
+
+
+def test_blank_line_runs_collapse_to_one(clean):
+    content = "\n\nIntro\n\n\n\n### [A](http://a)\n\n\n\nbody\n\n\n"
+    assert clean(content) == "Intro\n\n### [A](http://a)\n\nbody"
+
+
+def test_blank_runs_collapse_across_dropped_articles(clean):
+    content = "### [A](http://a)\nfirst\n\n### [A](http://a)\ndup\n\n\n### [B](http://b)\nsecond"
+    assert clean(content) == "### [A](http://a)\nfirst\n\n### [B](http://b)\nsecond"
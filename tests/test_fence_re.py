@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def abstract(load_script):
+    return load_script("1_article_to_abstract_md.py")
+
+
+def test_fenced_response_is_unwrapped(abstract):
+    match = abstract.FENCE_RE.match("```markdown\n### [T](http://a)\nbody\n```")
+    assert match.group(1) == "### [T](http://a)\nbody"
+
+
+def test_fence_without_language_is_unwrapped(abstract):
+    match = abstract.FENCE_RE.match("```\n### T\nbody\n```  \n")
+    assert match.group(1) == "### T\nbody"
+
+
+def test_missing_closing_fence_strips_opening_fence_only(abstract):
+    text = "```markdown\n### T\nbody"
+    assert abstract.FENCE_RE.match(text) is None
+    assert abstract.OPEN_FENCE_RE.sub("", text, count=1) == "### T\nbody"
+
+
+def test_unfenced_response_is_left_alone(abstract):
+    text = "### T\nbody with ``` inside"
+    assert abstract.FENCE_RE.match(text) is None
+    assert abstract.OPEN_FENCE_RE.sub("", text, count=1) == text